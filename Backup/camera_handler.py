@@ -1,16 +1,78 @@
 import cv2
+import os
+import sys
+import ctypes
 import threading
 import queue
 import time
 import numpy as np
 
+def pin_current_thread(cores):
+    """Restrict the calling thread to the given CPU cores (best effort)"""
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            # On Linux pid 0 refers to the calling thread
+            os.sched_setaffinity(0, cores)
+        elif sys.platform == "win32":
+            kernel32 = ctypes.windll.kernel32
+            mask = sum(1 << core for core in cores)
+            kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), mask)
+    except (OSError, ValueError) as e:
+        print(f"Failed to set CPU affinity {sorted(cores)}: {e}")
+
+class LatestFrame:
+    """Single-slot frame holder: the producer overwrites, a consumer takes the newest frame.
+    
+    The optional transform is applied on the consumer side, so frames that are
+    overwritten before anyone reads them are never processed.
+    """
+    def __init__(self, transform=None):
+        self._frame = None
+        self._transform = transform
+        self._cond = threading.Condition()
+    
+    def put(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._cond.notify()
+    
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: self._frame is not None, timeout)
+            frame, self._frame = self._frame, None
+        
+        if frame is None:
+            raise queue.Empty
+        if self._transform is not None:
+            frame = self._transform(frame)
+        return frame
+    
+    def get_nowait(self):
+        return self.get(block=False)
+    
+    def peek(self):
+        """Return the newest untransformed frame without consuming it"""
+        return self._frame
+    
+    def empty(self):
+        return self._frame is None
+    
+    def clear(self):
+        with self._cond:
+            self._frame = None
+
 class CameraHandler:
-    def __init__(self, camera_index=0, buffer_size=5, frame_rate=30):
+    def __init__(self, camera_index=0, buffer_size=5, frame_rate=30, cpu_affinity=None):
         self.camera_index = camera_index
         self.buffer_size = buffer_size
         self.frame_rate = frame_rate
+        self.cpu_affinity = cpu_affinity  # Cores for the capture thread, None to leave unpinned
         
-        self.frame_queue = queue.Queue(maxsize=buffer_size)
+        # Only the freshest raw frame is kept; it is enhanced when a consumer
+        # takes it, so stale frames are never enhanced or captioned
+        self.frame_queue = LatestFrame(transform=self._enhance_frame)
+        self._enhance_lock = threading.Lock()
         self.is_capturing = False
         self.capture_thread = None
         self.camera = None
@@ -20,14 +82,27 @@ class CameraHandler:
         self.contrast = 1.2
         self.saturation = 1.1
         
-        # Advanced sharpening kernel
-        self.sharpness_kernel = np.array([
-            [-1, -1, -1, -1, -1],
-            [-1,  2,  2,  2, -1],
-            [-1,  2,  8,  2, -1],
-            [-1,  2,  2,  2, -1],
-            [-1, -1, -1, -1, -1]
-        ]) / 8.0
+        # Denoising strategy: "luma" (NLM on the Y plane) or "bilateral" (faster)
+        self.denoise_mode = "luma"
+        
+        # Unsharp-mask sharpening: frame + amount * (frame - blur(frame))
+        self.sharpen_amount = 0.5
+        self.sharpen_sigma = 1.0
+        
+        # Scratch buffers reused across frames (sized for the 1280x720 stream)
+        self._allocate_buffers((720, 1280, 3))
+        
+        # Offload enhancement to the GPU when OpenCV is built with CUDA
+        self.use_cuda = hasattr(cv2, "cuda") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+        if self.use_cuda:
+            print("CUDA frame enhancement enabled")
+            self._stream = cv2.cuda_Stream()
+            self._gpu_frame = cv2.cuda_GpuMat()
+            # CUDA filters only support 1 or 4 channel images
+            ksize = 2 * int(round(3 * self.sharpen_sigma)) + 1
+            self._gpu_blur = cv2.cuda.createGaussianFilter(
+                cv2.CV_8UC4, cv2.CV_8UC4, (ksize, ksize), self.sharpen_sigma
+            )
     
     def _init_camera(self):
         """Initialize camera with multiple attempts and fallback options"""
@@ -94,39 +169,89 @@ class CameraHandler:
             self.capture_thread.daemon = True
             self.capture_thread.start()
     
+    def _allocate_buffers(self, shape):
+        self._blur = np.empty(shape, np.uint8)
+        self._sharp = np.empty(shape, np.uint8)
+        self._gray = np.empty(shape[:2], np.uint8)
+        self._gray3 = np.empty(shape, np.uint8)
+    
     def _enhance_frame(self, frame):
-        # Convert to float32 for better precision
-        frame_float = frame.astype(np.float32) / 255.0
-        
-        # Apply advanced color enhancement
-        frame_enhanced = cv2.convertScaleAbs(
-            frame_float, 
-            alpha=self.contrast, 
-            beta=self.brightness - 1
-        )
+        # Runs on consumer threads; serialize access to the scratch buffers
+        # and the CUDA stream
+        with self._enhance_lock:
+            if self.use_cuda:
+                return self._enhance_frame_cuda(frame)
+            return self._enhance_frame_cpu(frame)
+    
+    def _enhance_frame_cpu(self, frame):
+        if frame.shape != self._sharp.shape:
+            self._allocate_buffers(frame.shape)
         
-        # Apply sharpening
-        frame_sharp = cv2.filter2D(frame_enhanced, -1, self.sharpness_kernel)
+        # Apply sharpening (unsharp mask) with contrast and brightness folded
+        # into the same weighted sum: a * ((1 + k) * x - k * blur) + b
+        blur = cv2.GaussianBlur(frame, (0, 0), self.sharpen_sigma, dst=self._blur)
+        alpha = self.contrast
+        amount = self.sharpen_amount
+        frame_sharp = cv2.addWeighted(frame, alpha * (1 + amount), blur, -alpha * amount,
+                                      (self.brightness - 1) * 255, dst=self._sharp)
         
         # Apply selective noise reduction
-        frame_denoised = cv2.fastNlMeansDenoisingColored(
-            (frame_sharp * 255).astype(np.uint8),
-            None,
-            h=3,
-            hColor=3,
-            templateWindowSize=7,
-            searchWindowSize=21
-        )
-        
-        # Enhance saturation
-        hsv = cv2.cvtColor(frame_denoised, cv2.COLOR_BGR2HSV).astype(np.float32)
-        hsv[:, :, 1] = hsv[:, :, 1] * self.saturation
-        hsv[:, :, 1] = np.clip(hsv[:, :, 1], 0, 255)
-        frame_final = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+        frame_denoised = self._denoise(frame_sharp)
+        
+        # Enhance saturation by pushing each pixel away from its gray level,
+        # which avoids a BGR -> HSV -> BGR round trip
+        gray = cv2.cvtColor(frame_denoised, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        gray3 = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=self._gray3)
+        frame_final = cv2.addWeighted(frame_denoised, self.saturation, gray3, 1.0 - self.saturation, 0.0)
+        
+        return frame_final
+    
+    def _denoise(self, frame):
+        if self.denoise_mode == "bilateral":
+            return cv2.bilateralFilter(frame, d=5, sigmaColor=25, sigmaSpace=25)
+        
+        # Only denoise luminance; chroma noise is far less visible and this
+        # avoids the cost of the colored NLM variant
+        y, cr, cb = cv2.split(cv2.cvtColor(frame, cv2.COLOR_BGR2YCrCb))
+        y = cv2.fastNlMeansDenoising(y, None, h=3, templateWindowSize=7, searchWindowSize=15)
+        return cv2.cvtColor(cv2.merge((y, cr, cb)), cv2.COLOR_YCrCb2BGR)
+    
+    def _enhance_frame_cuda(self, frame):
+        stream = self._stream
+        self._gpu_frame.upload(frame, stream)
         
+        # Sharpening and color enhancement, as on the CPU path
+        gpu = cv2.cuda.cvtColor(self._gpu_frame, cv2.COLOR_BGR2BGRA, stream=stream)
+        blur = self._gpu_blur.apply(gpu, stream=stream)
+        alpha = self.contrast
+        amount = self.sharpen_amount
+        gpu = cv2.cuda.addWeighted(gpu, alpha * (1 + amount), blur, -alpha * amount,
+                                   (self.brightness - 1) * 255, stream=stream)
+        gpu = cv2.cuda.cvtColor(gpu, cv2.COLOR_BGRA2BGR, stream=stream)
+        
+        # Noise reduction
+        if self.denoise_mode == "bilateral":
+            gpu = cv2.cuda.bilateralFilter(gpu, 5, 25, 25, stream=stream)
+        else:
+            gpu = cv2.cuda.cvtColor(gpu, cv2.COLOR_BGR2YCrCb, stream=stream)
+            y, cr, cb = cv2.cuda.split(gpu, stream=stream)
+            y = cv2.cuda.fastNlMeansDenoising(y, 3, search_window=15, block_size=7, stream=stream)
+            gpu = cv2.cuda.merge([y, cr, cb], stream=stream)
+            gpu = cv2.cuda.cvtColor(gpu, cv2.COLOR_YCrCb2BGR, stream=stream)
+        
+        # Saturation, blending away from the gray level as on the CPU path
+        gray = cv2.cuda.cvtColor(gpu, cv2.COLOR_BGR2GRAY, stream=stream)
+        gray = cv2.cuda.cvtColor(gray, cv2.COLOR_GRAY2BGR, stream=stream)
+        gpu = cv2.cuda.addWeighted(gpu, self.saturation, gray, 1.0 - self.saturation, 0.0, stream=stream)
+        
+        frame_final = gpu.download(stream)
+        stream.waitForCompletion()
         return frame_final
     
     def _capture_frames(self):
+        if self.cpu_affinity:
+            pin_current_thread(self.cpu_affinity)
+        
         consecutive_failures = 0
         max_failures = 5
         
@@ -150,16 +275,9 @@ class CameraHandler:
                     continue
                 
                 consecutive_failures = 0
-                enhanced_frame = self._enhance_frame(frame)
                 
-                try:
-                    if self.frame_queue.full():
-                        self.frame_queue.get_nowait()
-                    self.frame_queue.put(enhanced_frame, block=False)
-                except queue.Full:
-                    pass
-                
-                time.sleep(1.0 / self.frame_rate)
+                # Overwrite the previous frame; camera.read() paces the loop
+                self.frame_queue.put(frame)
                 
             except Exception as e:
                 print(f"Error in capture loop: {e}")
@@ -172,6 +290,11 @@ class CameraHandler:
         except queue.Empty:
             return None
     
+    def get_latest_raw_frame(self):
+        # Cheap preview path: no enhancement and the frame stays available
+        # for the captioner
+        return self.frame_queue.peek()
+    
     def save_frame(self, frame, filename='latest_capture.jpg'):
         if frame is not None:
             # Save with high quality
@@ -186,8 +309,4 @@ class CameraHandler:
         if self.camera:
             self.camera.release()
         
-        while not self.frame_queue.empty():
-            try:
-                self.frame_queue.get_nowait()
-            except queue.Empty:
-                break
\ No newline at end of file
+        self.frame_queue.clear()
\ No newline at end of file
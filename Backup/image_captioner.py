@@ -1,35 +1,32 @@
 import tensorflow as tf
 import numpy as np
-from PIL import Image
-import cv2
 import threading
 import queue
 import time
 from transformers import TFBlipForConditionalGeneration, BlipProcessor
 
 class PIDController:
+    __slots__ = ("kp", "ki", "kd", "prev_error", "integral", "last_update")
+    
     def __init__(self, kp=0.6, ki=0.2, kd=0.3):
         self.kp = kp
         self.ki = ki
         self.kd = kd
-        self.prev_error = 0
-        self.integral = 0
-        self.last_update = time.time()
+        self.prev_error = 0.0
+        self.integral = 0.0
+        self.last_update = time.perf_counter()
 
     def update(self, error):
-        current_time = time.time()
-        dt = current_time - self.last_update
-        
-        self.integral += error * dt
-        derivative = (error - self.prev_error) / dt if dt > 0 else 0
+        now = time.perf_counter()
+        dt = now - self.last_update
         
-        output = (self.kp * error + 
-                 self.ki * self.integral + 
-                 self.kd * derivative)
+        integral = self.integral + error * dt
+        derivative = (error - self.prev_error) / dt if dt > 0 else 0.0
         
+        self.integral = integral
         self.prev_error = error
-        self.last_update = current_time
-        return output
+        self.last_update = now
+        return self.kp * error + self.ki * integral + self.kd * derivative
 
 class ImageCaptioner:
     def __init__(self, 
@@ -45,7 +42,12 @@ class ImageCaptioner:
         if physical_devices:
             tf.config.experimental.set_memory_growth(physical_devices[0], True)
             print("GPU acceleration enabled")
-        
+
+            # Enable mixed precision for faster inference; the policy must be
+            # set before the model is built so its layers compute in float16.
+            # Only on GPU: float16 on CPU is slower than float32
+            tf.keras.mixed_precision.set_global_policy('mixed_float16')
+
         # Load models
         print("Loading models...")
         self.processor = BlipProcessor.from_pretrained(model_name)
@@ -53,11 +55,14 @@ class ImageCaptioner:
         self.model = TFBlipForConditionalGeneration.from_pretrained(model_name)
         print("Models loaded successfully")
         
-        # Enable mixed precision for faster inference
-        tf.keras.mixed_precision.set_global_policy('mixed_float16')
+        # Image preprocessing constants, taken from the BLIP image processor
+        image_processor = self.processor.image_processor
+        self._image_size = [image_processor.size["height"], image_processor.size["width"]]
+        self._mean = tf.constant(image_processor.image_mean, dtype=tf.float32)
+        self._std = tf.constant(image_processor.image_std, dtype=tf.float32)
         
+        # Holds (caption, accuracy) pairs so the two can never get out of sync
         self.caption_queue = queue.Queue(maxsize=caption_queue_size)
-        self.accuracy_queue = queue.Queue(maxsize=caption_queue_size)
         
         self.process_interval = process_interval
         self.is_processing = False
@@ -65,7 +70,9 @@ class ImageCaptioner:
         
         self.frame_queue = None
         self.pid = PIDController()
-        self.target_accuracy = 0.85
+        # Confidence is the geometric mean token probability of the whole
+        # caption, which sits well below the top probability of a single token
+        self.target_accuracy = 0.6
         
         # Set generation parameters
         self.max_length = 30
@@ -75,98 +82,115 @@ class ImageCaptioner:
             "num_beams": self.num_beams,
             "temperature": 0.7,
             "top_p": 0.9,
-            "repetition_penalty": 1.2
-        
-        
+            "repetition_penalty": 1.2,
+            "early_stopping": True,
+            "length_penalty": 1.0
         }
-
-    def _preprocess_image(self, image):
-        # Convert PIL to numpy array if needed
-        if isinstance(image, Image.Image):
-            image = np.array(image)
-        
-        # # Convert BGR to RGB if needed
-        # if len(image.shape) == 3 and image.shape[2] == 3:
-        #     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         
-        # # Process image using the processor
-        # inputs = self.processor(images=image, return_tensors="tf")
-        # return inputs
-        if isinstance(image, np.ndarray) and len(image.shape) == 3 and image.shape[2] == 3:
-              image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # Process image using the processor
-        inputs = self.processor(images=image, return_tensors="tf", padding=True)
-        return inputs['pixel_values']
+        # Compiled generate graphs, one per (beam count, batch size)
+        self._generate_fns = {}
+
+    def _preprocess_images(self, frames):
+        # Stack the raw BGR frames and preprocess the whole batch in one graph
+        return self._preprocess_fn(np.stack(frames))
 
-    @tf.function(experimental_relax_shapes=True)
-    def _generate_caption(self, pixel_values):
-        # outputs = self.model.generate(
-        #     pixel_values,
-        #     **self.gen_kwargs,
-        #     return_dict_in_generate=True,
-        #     output_scores=True
-         outputs = self.model.generate(
-        pixel_values=pixel_values,
-        max_length=self.max_length,
-        num_beams=self.num_beams,
-        temperature=self.gen_kwargs["temperature"],
-        top_p=self.gen_kwargs["top_p"],
-        repetition_penalty=self.gen_kwargs["repetition_penalty"],
-        return_dict_in_generate=True,
-        output_scores=True
-        )
-         return outputs
+    @tf.function(input_signature=[tf.TensorSpec([None, None, None, 3], tf.uint8)])
+    def _preprocess_fn(self, frames):
+        # BGR -> RGB, resize, normalize, NHWC -> NCHW
+        x = tf.reverse(tf.cast(frames, tf.float32), axis=[-1])
+        # Antialias the large downscale and clip the bicubic overshoot, as the
+        # PIL-based processor does
+        x = tf.image.resize(x, self._image_size, method='bicubic', antialias=True)
+        x = tf.clip_by_value(x, 0.0, 255.0)
+        x = (x / 255.0 - self._mean) / self._std
+        return tf.transpose(x, [0, 3, 1, 2])
+
+    def _generate_caption(self, pixel_values, num_beams):
+        batch_size = int(pixel_values.shape[0])
+        key = (num_beams, batch_size)
+        fn = self._generate_fns.get(key)
+        if fn is None:
+            # Bind the generation parameters as constants and fix the input
+            # signature so each graph is traced once. generate() sizes its
+            # prompt from pixel_values.shape[0], so the batch dimension must
+            # be static too
+            gen_kwargs = dict(self.gen_kwargs, max_length=self.max_length, num_beams=num_beams)
+            
+            @tf.function(input_signature=[tf.TensorSpec([batch_size, 3, *self._image_size], tf.float32)])
+            def fn(pixel_values):
+                outputs = self.model.generate(
+                    pixel_values=pixel_values,
+                    **gen_kwargs,
+                    return_dict_in_generate=True
+                )
+
+                # Per-step scores are only collected when generate() runs
+                # eagerly, but beam search always returns the length-normalized
+                # log-probability of each final sequence. Its exponential is the
+                # geometric mean token probability, computed on device so only
+                # a length-B vector is copied back to the host
+                mean_conf = tf.exp(tf.cast(outputs.sequences_scores, tf.float32))
+                return outputs.sequences, mean_conf
+            
+            self._generate_fns[key] = fn
+        
+        return fn(pixel_values)
 
     def _process_frames(self):
-        batch_size = 1
+        batch_size = 4
         frames_buffer = []
         last_process_time = time.time()
         
         
         while self.is_processing:
             try:
-                current_time = time.time()
-                if current_time - last_process_time >= self.process_interval:
-                    while len(frames_buffer) < batch_size and not self.frame_queue.empty():
-                        frame = self.frame_queue.get_nowait()
-                        frames_buffer.append(frame)
+                # Collect frames until the batch is full or the interval is up
+                deadline = last_process_time + self.process_interval
+                while len(frames_buffer) < batch_size:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        frames_buffer.append(self.frame_queue.get(block=True, timeout=timeout))
+                    except queue.Empty:
+                        break
+                
+                # Nothing arrived during the interval, block until a frame does
+                if not frames_buffer:
+                    frames_buffer.append(self.frame_queue.get(block=True, timeout=self.process_interval))
+                
+                try:
+                    # Process batch
+                    batch_pixel_values = self._preprocess_images(frames_buffer)
                     
-                    if frames_buffer:
-                        try:
-                            # Process batch
-                            processed_images = [self._preprocess_image(frame) for frame in frames_buffer]
-                            
-                            # Combine pixel values from processed images
-                            batch_pixel_values = tf.concat([img['pixel_values'] for img in processed_images], axis=0)
-                            
-                            # Generate captions
-                            outputs = self.generate_caption_fn(batch_pixel_values)
-                            
-                            # Decode captions
-                            captions = self.processor.batch_decode(outputs.sequences, skip_special_tokens=True)
-                            
-                            # Calculate confidence scores
-                            scores = tf.nn.softmax(outputs.scores[0], axis=-1)
-                            accuracies = tf.reduce_max(scores, axis=-1).numpy()
-                            
-                            # Update queues
-                            for caption, accuracy in zip(captions, accuracies):
-                                self._update_caption_queue(caption, float(np.mean(accuracy)))
-                            
-                            # PID control
-                            avg_accuracy = np.mean(accuracies)
-                            error = self.target_accuracy - avg_accuracy
-                            adjustment = self.pid.update(error)
-                            self.process_interval = max(0.3, min(2.0, self.process_interval + adjustment))
-                        
-                        except Exception as e:
-                            print(f"Error in caption generation: {e}")
-                        
-                        frames_buffer.clear()
-                        last_process_time = current_time
+                    # Generate captions
+                    sequences, confidences = self.generate_caption_fn(batch_pixel_values, self.num_beams)
+                    
+                    # Decode captions
+                    captions = self.processor.batch_decode(sequences, skip_special_tokens=True)
+                    accuracies = confidences.numpy()
+                    
+                    # Update queues
+                    for caption, accuracy in zip(captions, accuracies):
+                        self._update_caption_queue(caption, float(accuracy))
+                    
+                    # PID control
+                    avg_accuracy = np.mean(accuracies)
+                    error = self.target_accuracy - avg_accuracy
+                    adjustment = self.pid.update(error)
+                    self.process_interval = max(0.3, min(2.0, self.process_interval + adjustment))
+                    
+                    # Spend fewer beams on confident (stable) scenes, more on hard
+                    # ones; at least 2, since greedy search reports no sequence score
+                    self.num_beams = int(np.clip(
+                        round(2 + 4 * (self.target_accuracy - avg_accuracy) / self.target_accuracy), 2, 5
+                    ))
+                
+                except Exception as e:
+                    print(f"Error in caption generation: {e}")
                 
-                time.sleep(0.01)
+                frames_buffer.clear()
+                last_process_time = time.time()
                 
             except queue.Empty:
                 continue
@@ -185,17 +209,14 @@ class ImageCaptioner:
         try:
             if self.caption_queue.full():
                 self.caption_queue.get_nowait()
-                self.accuracy_queue.get_nowait()
             
-            self.caption_queue.put(caption, block=False)
-            self.accuracy_queue.put(accuracy, block=False)
-        except queue.Full:
+            self.caption_queue.put_nowait((caption, accuracy))
+        except (queue.Empty, queue.Full):
             pass
     
     def get_latest_caption(self):
         try:
-            caption = self.caption_queue.get_nowait()
-            accuracy = self.accuracy_queue.get_nowait()
+            caption, accuracy = self.caption_queue.get_nowait()
             return f"{caption} (Confidence: {accuracy:.2%})"
         except queue.Empty:
             return None
@@ -209,6 +230,5 @@ class ImageCaptioner:
         while not self.caption_queue.empty():
             try:
                 self.caption_queue.get_nowait()
-                self.accuracy_queue.get_nowait()
             except queue.Empty:
                 break
\ No newline at end of file
@@ -4,10 +4,11 @@ import time
 import tkinter as tk
 from tkinter import scrolledtext
 import cv2
+import numpy as np
 from PIL import Image, ImageTk
 import os
 
-from camera_handler import CameraHandler
+from camera_handler import CameraHandler, pin_current_thread
 from image_captioner import ImageCaptioner
 
 os.environ['DISPLAY'] = ':0'
@@ -17,11 +18,15 @@ class RealTimeCaptioningApp:
         self.root = root
         self.root.title("Real-Time Image Captioning")
         
+        # Keep the UI and capture threads on separate cores when there are enough
+        many_cores = (os.cpu_count() or 1) >= 4
+        
         # Initialize camera handler
         self.camera_handler = CameraHandler(
             camera_index=0,  # Primary camera
             buffer_size=5,   # Frame buffer size
-            frame_rate=30     # Frames per second
+            frame_rate=30,    # Frames per second
+            cpu_affinity={2, 3} if many_cores else None
         )
         
         # Initialize image captioner
@@ -43,6 +48,9 @@ class RealTimeCaptioningApp:
         self.start_time = time.time()
         self.fps = 0
         
+        # Reused buffer for the 640x480 preview
+        self._preview_buf = np.empty((480, 640, 3), np.uint8)
+        
         # Create UI components
         self.create_ui()
         
@@ -52,6 +60,11 @@ class RealTimeCaptioningApp:
         # Start camera and captioning
         self.start_capture()
         
+        # Pin the UI thread last so the model and worker threads started above
+        # don't inherit its affinity
+        if many_cores:
+            pin_current_thread({0, 1})
+        
         # Set up keyboard shortcuts
         self.root.bind('<space>', lambda e: self.toggle_capture())
         self.root.bind('<Escape>', lambda e: self.root.quit())
@@ -61,6 +74,10 @@ class RealTimeCaptioningApp:
         self.video_frame = tk.Label(self.root)
         self.video_frame.pack(padx=10, pady=10)
         
+        # Single Tk image that every preview frame is pasted into
+        self._tk_image = ImageTk.PhotoImage(image=Image.new('RGB', (640, 480)))
+        self.video_frame.config(image=self._tk_image)
+        
         # Caption display
         self.caption_label = tk.Label(self.root, text="Waiting for caption...", 
                                       font=("Arial", 12), wraplength=400)
@@ -84,22 +101,18 @@ class RealTimeCaptioningApp:
     
     def update_frame(self):
         # Get latest frame
-        frame = self.camera_handler.get_latest_frame()
+        frame = self.camera_handler.get_latest_raw_frame()
         
         if frame is not None:
+            # Downscale with OpenCV's area resampler into the preview buffer
+            preview = cv2.resize(frame, (640, 480), dst=self._preview_buf, interpolation=cv2.INTER_AREA)
+            
             # Convert frame for Tkinter
-            cv_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            cv_image = cv2.cvtColor(preview, cv2.COLOR_BGR2RGB, dst=preview)
             pil_image = Image.fromarray(cv_image)
             
-            # Resize if needed
-            pil_image = pil_image.resize((640, 480), Image.LANCZOS)
-            
-            # Convert to Tkinter-compatible image
-            tk_image = ImageTk.PhotoImage(pil_image)
-            
-            # Update video frame
-            self.video_frame.config(image=tk_image)
-            self.video_frame.image = tk_image
+            # Update video frame in place
+            self._tk_image.paste(pil_image)
         
         # Schedule next update
         self.root.after(100, self.update_frame)
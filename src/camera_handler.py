@@ -1,7 +1,6 @@
 import cv2
 import threading
 import queue
-import time
 import numpy as np
 
 class CameraHandler:
@@ -21,6 +20,9 @@ class CameraHandler:
         self.sharpness_kernel = np.array([[-1,-1,-1],
                                         [-1, 9,-1],
                                         [-1,-1,-1]])
+        
+        # Denoising strategy: "luma" (NLM on the Y plane) or "bilateral" (faster)
+        self.denoise_mode = "luma"
     
     def start_capture(self):
         if not self.is_capturing:
@@ -49,41 +51,43 @@ class CameraHandler:
         enhanced = cv2.filter2D(enhanced, -1, self.sharpness_kernel)
         
         # Apply subtle noise reduction
-        enhanced = cv2.fastNlMeansDenoisingColored(enhanced, None, 5, 5, 7, 21)
+        enhanced = self._denoise(enhanced)
         
         return enhanced
     
-    def _capture_frames(self):
-        last_frame_time = time.time()
-        frame_interval = 1.0 / self.frame_rate
+    def _denoise(self, frame):
+        if self.denoise_mode == "bilateral":
+            return cv2.bilateralFilter(frame, d=5, sigmaColor=25, sigmaSpace=25)
         
+        # Only denoise luminance; chroma noise is far less visible and this
+        # avoids the cost of the colored NLM variant
+        y, cr, cb = cv2.split(cv2.cvtColor(frame, cv2.COLOR_BGR2YCrCb))
+        y = cv2.fastNlMeansDenoising(y, None, h=3, templateWindowSize=7, searchWindowSize=15)
+        return cv2.cvtColor(cv2.merge((y, cr, cb)), cv2.COLOR_YCrCb2BGR)
+    
+    def _capture_frames(self):
         while self.is_capturing:
-            current_time = time.time()
-            if current_time - last_frame_time >= frame_interval:
-                ret, frame = self.camera.read()
-                
-                if not ret:
-                    print("Failed to capture frame")
-                    break
-                
-                # Enhance the captured frame
-                enhanced_frame = self._enhance_frame(frame)
-                
+            # Blocking read; the camera delivers frames at its configured FPS
+            ret, frame = self.camera.read()
+            
+            if not ret:
+                print("Failed to capture frame")
+                break
+            
+            # Enhance the captured frame
+            enhanced_frame = self._enhance_frame(frame)
+            
+            # Drop the stalest frame to make room
+            if self.frame_queue.full():
                 try:
-                    if self.frame_queue.full():
-                        try:
-                            self.frame_queue.get_nowait()
-                        except queue.Empty:
-                            pass
-                    
-                    self.frame_queue.put(enhanced_frame, block=False)
-                except queue.Full:
+                    self.frame_queue.get_nowait()
+                except queue.Empty:
                     pass
-                
-                last_frame_time = current_time
-            else:
-                # Small sleep to prevent CPU overuse
-                time.sleep(0.001)
+            
+            try:
+                self.frame_queue.put(enhanced_frame, block=True, timeout=1.0)
+            except queue.Full:
+                pass
     
     def get_latest_frame(self):
         try:
@@ -8,7 +8,7 @@ from PIL import Image, ImageTk
 import os
 
 from camera_handler import CameraHandler
-from image_captioner import ImageCaptioner
+from image_captioner import CaptionerProcess
 
 os.environ['DISPLAY'] = ':0'
 
@@ -24,8 +24,8 @@ class RealTimeCaptioningApp:
             frame_rate=30     # Frames per second
         )
         
-        # Initialize image captioner
-        self.image_captioner = ImageCaptioner(
+        # Initialize image captioner (runs in its own process)
+        self.image_captioner = CaptionerProcess(
             model_name="microsoft/git-base-coco",
             caption_queue_size=3,
             process_interval=2
@@ -42,6 +42,10 @@ class RealTimeCaptioningApp:
         self.video_frame = tk.Label(self.root)
         self.video_frame.pack(padx=10, pady=10)
         
+        # Single Tk image that every preview frame is pasted into
+        self._photo = ImageTk.PhotoImage(image=Image.new('RGB', (640, 480)))
+        self.video_frame.config(image=self._photo)
+        
         # Caption display
         self.caption_label = tk.Label(self.root, text="Waiting for caption...", 
                                       font=("Arial", 12), wraplength=400)
@@ -67,15 +71,11 @@ class RealTimeCaptioningApp:
             cv_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             pil_image = Image.fromarray(cv_image)
             
-            # Resize if needed
-            pil_image = pil_image.resize((640, 480), Image.LANCZOS)
-            
-            # Convert to Tkinter-compatible image
-            tk_image = ImageTk.PhotoImage(pil_image)
+            # Resize for the preview; bilinear is indistinguishable at this size
+            pil_image = pil_image.resize((640, 480), Image.BILINEAR)
             
-            # Update video frame
-            self.video_frame.config(image=tk_image)
-            self.video_frame.image = tk_image
+            # Update video frame in place
+            self._photo.paste(pil_image)
         
         # Schedule next update
         self.root.after(100, self.update_frame)